@@ -10,12 +10,15 @@ Japanese, Chinese, and Korean to qualify for bonus points.
 """
 
 import os
-import json
 import time
 import re
-import statistics
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import Dict, Any
+
+import numpy as np
+import orjson
 
 try:
     import fitz  # PyMuPDF
@@ -24,6 +27,29 @@ except ImportError:
     print("Missing PyMuPDF library. Install with: pip install PyMuPDF")
     exit(1)
 
+# Page footer noise such as "A - 12" or "B 3/10".
+_NOISE_RE = re.compile(r"^[A-Z]\s*(?:-\s*\d+|\d+/\d+)$")
+# Japanese chapter/section markers such as "第三章" or "第2節".
+_JP_CHAPTER_RE = re.compile(r'第[一二三四五六七八九十百千万\d]+[章節]')
+# CJK character ranges used for language detection.
+_CJK_RE = re.compile(r'[\u3040-\u30ff\u4e00-\u9fff\uac00-\ud7a3]')
+_KANA_RE = re.compile(r'[\u3040-\u30ff]')  # Hiragana/Katakana
+_HAN_RE = re.compile(r'[\u4e00-\u9fff]')  # CJK Unified Ideographs
+
+def _heading_candidates(sizes, lengths, word_counts, is_bold, ends_with_period, median):
+    """Applies the numeric heading rules to a batch of lines and returns a boolean mask."""
+    # np.float64 keeps the size comparison in double precision, as with the scalar rules.
+    min_size = np.float64(median) * 1.15
+    return (
+        # Rule 1: Length constraints
+        (lengths > 3) & (lengths < 150)
+        # Rule 2: Must be larger than median text. Bonus points for being bold.
+        & ((sizes > min_size) | is_bold)
+        # Rule 3: Filter out long sentences
+        & (word_counts <= 12)
+        & ~(ends_with_period & (word_counts > 6))
+    )
+
 class PDFOutlineExtractor:
     """Extracts structured outlines from PDF documents with advanced heuristics."""
 
@@ -31,94 +57,73 @@ class PDFOutlineExtractor:
         """Initialize the extractor with refined parameters."""
         self.max_pages_to_analyze = 50
 
-    def _get_font_stats(self, doc: Document) -> Dict[str, float]:
-        """Analyzes the document to get statistics about font sizes."""
-        all_font_sizes = []
-        pages_to_scan = min(len(doc), self.max_pages_to_analyze)
-        for page_num in range(pages_to_scan):
-            page = doc[page_num]
-            blocks = page.get_text("dict").get("blocks", [])
-            for block in blocks:
-                if "lines" in block:
-                    for line in block["lines"]:
-                        for span in line["spans"]:
-                            if span["text"].strip():
-                                all_font_sizes.append(span["size"])
-        
-        if not all_font_sizes:
+    def _get_font_stats(self, font_sizes: array) -> Dict[str, float]:
+        """Computes statistics about the font sizes collected from the document."""
+        if not font_sizes:
             return {"median": 12.0, "p75": 14.0, "p90": 16.0}
 
-        return {
-            "median": statistics.median(all_font_sizes),
-            "p75": statistics.quantiles(all_font_sizes, n=4)[2],
-            "p90": statistics.quantiles(all_font_sizes, n=10)[8],
-        }
+        sizes = np.frombuffer(font_sizes, dtype=np.float32)
+        # 'weibull' is the exclusive method used by statistics.quantiles, not numpy's linear default.
+        median, p75, p90 = np.percentile(sizes, [50, 75, 90], method='weibull').tolist()
+        return {"median": median, "p75": p75, "p90": p90}
 
     def _detect_language(self, text: str) -> str:
         """Simple language detection based on character ranges for CJK."""
-        if any('\u3040' <= char <= '\u30ff' for char in text): # Hiragana/Katakana
+        match = _CJK_RE.search(text)
+        if match is None:
+            return 'english'
+        # Kana anywhere marks Japanese, then Han ideographs mark Chinese. The first
+        # CJK character is where the search stopped, so only the rest needs scanning.
+        start = match.start()
+        if _KANA_RE.search(text, start):
             return 'japanese'
-        if any('\u4e00' <= char <= '\u9fff' for char in text): # CJK Unified Ideographs
+        if _HAN_RE.search(text, start):
             return 'chinese'
-        if any('\uac00' <= char <= '\ud7a3' for char in text): # Hangul Syllables
-            return 'korean'
-        return 'english'
+        return 'korean'
 
-    def detect_title(self, doc: Document) -> str:
-        """Detects the main title of the document from the first page."""
+    def detect_title(self, doc: Document, first_page: Dict[str, Any]) -> str:
+        """Detects the main title of the document from the parsed first page."""
         try:
             if doc.metadata and doc.metadata.get('title'):
                 title = doc.metadata['title'].strip()
                 if title and len(title) > 4 and not title.lower().endswith('.pdf'):
                     return title
 
-            page = doc[0]
-            blocks = page.get_text("dict").get("blocks", [])
-            candidates = []
+            # page.rect follows the page rotation; the dict "height" is the unrotated one.
+            title_zone_bottom = doc[0].rect.height * 0.4
+            blocks = first_page.get("blocks", [])
+            texts = []
+            sizes = []
+            y_positions = []
             for block in blocks:
                 if "lines" in block:
                     for line in block["lines"]:
                         full_line_text = "".join(s["text"] for s in line["spans"]).strip()
                         if full_line_text and line["spans"]:
                             span = line["spans"][0]
-                            if span["bbox"][1] < page.rect.height * 0.4:
-                                candidates.append({
-                                    "text": full_line_text, "size": span["size"], "y_pos": span["bbox"][1]
-                                })
+                            if span["bbox"][1] < title_zone_bottom:
+                                texts.append(full_line_text)
+                                sizes.append(span["size"])
+                                y_positions.append(span["bbox"][1])
             
-            if candidates:
-                candidates.sort(key=lambda x: (-x["size"], x["y_pos"]))
-                return candidates[0]["text"]
+            if texts:
+                # Largest font first, topmost line breaking ties.
+                order = np.lexsort((np.array(y_positions), -np.array(sizes)))
+                return texts[order[0]]
         except Exception:
             pass
         return "Untitled Document"
 
     def _is_heading(self, line_text: str, font_size: float, is_bold: bool, font_stats: Dict[str, float]) -> bool:
-        """Determines if a line of text is likely a heading using multiple factors."""
-        # Rule 1: Must be larger than median text. Bonus points for being bold.
-        if font_size <= font_stats["median"] * 1.15 and not is_bold:
-            return False
-        
-        # Rule 2: Length constraints
-        if not (3 < len(line_text) < 150):
-            return False
-            
-        # Rule 3: Filter out common noise (page footers, etc.)
-        if re.match(r"^[A-Z]\s*-\s*\d+$", line_text) or re.match(r"^[A-Z]\s*\d+/\d+$", line_text):
-            return False
-            
-        # Rule 4: Filter out long sentences
-        word_count = len(line_text.split())
-        if word_count > 12:
-            return False
-        if line_text.endswith('.') and word_count > 6:
+        """Applies the text-based heading rules to a line that passed _heading_candidates."""
+        # Rule 4: Filter out common noise (page footers, etc.)
+        if _NOISE_RE.match(line_text):
             return False
 
-        # Language-specific patterns for bonus points
-        lang = self._detect_language(line_text)
-        if lang == 'japanese':
-            if re.search(r'第[一二三四五六七八九十百千万\d]+[章節]', line_text):
-                return True
+        # Language-specific patterns for bonus points. The chapter pattern only
+        # matches CJK text, so language detection is skipped for everything else.
+        if _JP_CHAPTER_RE.search(line_text) and self._detect_language(line_text) == 'japanese':
+            return True
         
         # A combination of size and boldness is a strong indicator
         if font_size > font_stats["median"] * 1.2 and is_bold:
@@ -137,6 +142,40 @@ class PDFOutlineExtractor:
             return "H2"
         return "H3"
 
+    def _collect_lines(self, page_dict: Dict[str, Any], page_num: int, font_sizes: array, lines: tuple):
+        """
+        Appends the non-empty lines of a parsed page to the column buffers in lines, which
+        _heading_candidates later checks for the whole document at once. The font size of
+        every non-empty span is appended to font_sizes in the same walk.
+        """
+        texts, page_nums, line_sizes, lengths, word_counts, bold_flags, period_flags = lines
+        add_size = font_sizes.append
+        for block in page_dict.get("blocks", []):
+            if "lines" in block:
+                for line in block["lines"]:
+                    spans = line["spans"]
+                    # Most lines hold a single span, which needs no joining.
+                    if len(spans) == 1:
+                        full_line_text = spans[0]["text"].strip()
+                        if full_line_text:
+                            add_size(spans[0]["size"])
+                    else:
+                        for s in spans:
+                            if s["text"].strip():
+                                add_size(s["size"])
+                        full_line_text = " ".join(s["text"].strip() for s in spans).strip()
+                    if not full_line_text:
+                        continue
+
+                    span = spans[0]
+                    texts.append(full_line_text)
+                    page_nums.append(page_num)
+                    line_sizes.append(span["size"])
+                    lengths.append(len(full_line_text))
+                    word_counts.append(full_line_text.count(' ') + 1)
+                    bold_flags.append("bold" in span["font"].lower())
+                    period_flags.append(full_line_text.endswith('.'))
+
     def extract_outline(self, pdf_path: str) -> Dict[str, Any]:
         """Extracts the title and a structured outline from a PDF."""
         outline = []
@@ -145,40 +184,75 @@ class PDFOutlineExtractor:
             if len(doc) == 0:
                 return {"title": "Empty Document", "outline": []}
 
-            title = self.detect_title(doc)
-            font_stats = self._get_font_stats(doc)
-            
             pages_to_scan = min(len(doc), self.max_pages_to_analyze)
+            # Parse each page once and keep only its lines in compact column buffers, so
+            # each page dict (including any image data) is freed before the next page is
+            # parsed. The title detection reuses the first page and the font statistics
+            # cover every scanned page.
+            font_sizes = array('f')
+            texts = []
+            page_nums = array('i')
+            line_sizes = array('f')
+            lengths = array('i')
+            word_counts = array('i')
+            bold_flags = array('b')
+            period_flags = array('b')
+            lines = (texts, page_nums, line_sizes, lengths, word_counts, bold_flags, period_flags)
+            for page_num in range(pages_to_scan):
+                page_dict = doc[page_num].get_text("dict")
+                if page_num == 0:
+                    title = self.detect_title(doc, page_dict)
+                self._collect_lines(page_dict, page_num, font_sizes, lines)
+
+            font_stats = self._get_font_stats(font_sizes)
             seen_headings = set()
 
-            for page_num in range(pages_to_scan):
-                page = doc[page_num]
-                blocks = page.get_text("dict").get("blocks", [])
-                for block in blocks:
-                    if "lines" in block:
-                        for line in block["lines"]:
-                            full_line_text = " ".join(s["text"].strip() for s in line["spans"]).strip()
-                            if full_line_text and line["spans"]:
-                                span = line["spans"][0]
-                                is_bold = "bold" in span["font"].lower()
-                                
-                                if self._is_heading(full_line_text, span["size"], is_bold, font_stats):
-                                    if full_line_text.lower() not in seen_headings:
-                                        level = self._classify_heading_level(span["size"], font_stats)
-                                        outline.append({
-                                            "level": level,
-                                            "text": full_line_text,
-                                            "page": page_num + 1
-                                        })
-                                        seen_headings.add(full_line_text.lower())
+            # Bind the methods used per line to locals to skip repeated attribute lookups.
+            is_heading = self._is_heading
+            classify = self._classify_heading_level
+            add_seen = seen_headings.add
+            append = outline.append
+
+            mask = _heading_candidates(
+                np.frombuffer(line_sizes, dtype=np.float32),
+                np.frombuffer(lengths, dtype=np.int32),
+                np.frombuffer(word_counts, dtype=np.int32),
+                np.frombuffer(bold_flags, dtype=np.bool_),
+                np.frombuffer(period_flags, dtype=np.bool_),
+                font_stats["median"],
+            )
+            for i in np.flatnonzero(mask).tolist():
+                full_line_text = texts[i]
+                size = line_sizes[i]
+                if is_heading(full_line_text, size, bool(bold_flags[i]), font_stats):
+                    key = full_line_text.casefold()
+                    if key not in seen_headings:
+                        level = classify(size, font_stats)
+                        append({
+                            "level": level,
+                            "text": full_line_text,
+                            "page": page_nums[i] + 1
+                        })
+                        add_seen(key)
             doc.close()
             return {"title": title, "outline": outline}
         except Exception as e:
             print(f"Error processing {pdf_path}: {e}")
             return {"title": "Error Processing Document", "outline": []}
 
+def _process_pdf(pdf_path: str, output_dir: str) -> float:
+    """Extracts the outline of a single PDF and saves it as JSON. Runs in a worker process."""
+    start_time = time.time()
+    extractor = PDFOutlineExtractor()
+    result = extractor.extract_outline(pdf_path)
+
+    output_file_path = Path(output_dir) / (Path(pdf_path).stem + ".json")
+    with open(output_file_path, 'wb') as f:
+        f.write(orjson.dumps(result, option=orjson.OPT_INDENT_2))
+    return time.time() - start_time
+
 def process_directory(input_dir: str, output_dir: str):
-    """Processes all PDFs in a directory and saves the outlines as JSON."""
+    """Processes all PDFs in a directory in parallel and saves the outlines as JSON."""
     input_path = Path(input_dir)
     output_path = Path(output_dir)
     
@@ -186,24 +260,25 @@ def process_directory(input_dir: str, output_dir: str):
         print(f"Input directory not found: {input_dir}")
         return
 
-    extractor = PDFOutlineExtractor()
-    
-    for pdf_file in input_path.glob("*.pdf"):
-        print(f"Processing {pdf_file.name}...")
-        start_time = time.time()
-        
-        result = extractor.extract_outline(str(pdf_file))
-        
-        output_filename = pdf_file.stem + ".json"
-        output_file_path = output_path / output_filename
-        
-        try:
-            with open(output_file_path, 'w', encoding='utf-8') as f:
-                json.dump(result, f, indent=2, ensure_ascii=False)
-            processing_time = time.time() - start_time
-            print(f"  > Finished in {processing_time:.2f}s. Output saved to {output_file_path}")
-        except Exception as e:
-            print(f"  > Error writing JSON for {pdf_file.name}: {e}")
+    pdf_files = list(input_path.glob("*.pdf"))
+    if not pdf_files:
+        return
+
+    # Each PDF is independent, so spread them over the available cores.
+    with ProcessPoolExecutor(max_workers=min(len(pdf_files), os.cpu_count() or 1)) as executor:
+        futures = {}
+        for pdf_file in pdf_files:
+            print(f"Processing {pdf_file.name}...")
+            futures[executor.submit(_process_pdf, str(pdf_file), str(output_path))] = pdf_file
+
+        for future in as_completed(futures):
+            pdf_file = futures[future]
+            output_file_path = output_path / (pdf_file.stem + ".json")
+            try:
+                processing_time = future.result()
+                print(f"  > {pdf_file.name} finished in {processing_time:.2f}s. Output saved to {output_file_path}")
+            except Exception as e:
+                print(f"  > Error processing {pdf_file.name}: {e}")
 
 def main():
     """Main entry point for the script."""
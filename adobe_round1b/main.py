@@ -1,13 +1,27 @@
 import os
+import re
 import json
 import time
-import statistics
+import hashlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import fitz  # PyMuPDF
-from sentence_transformers import SentenceTransformer, util
+import numpy as np
+import orjson
+from sentence_transformers import SentenceTransformer
 
 # --- OPTIMIZATION: Set a limit on pages to process for large documents ---
 MAX_PAGES_TO_PROCESS = 75
+# --- OPTIMIZATION: The model only reads 256 tokens, so longer section text is cut before tokenizing ---
+MAX_CHARS_TO_EMBED = 2000
+# --- OPTIMIZATION: Sections and embeddings are cached per PDF; bump this when extraction or the model changes ---
+CACHE_VERSION = 1
+# --- Section text must overlap the band between two headings by more than this many points.
+# Glyph ink starts slightly inside its span box, so the old clipped extraction skipped slimmer overlaps ---
+CLIP_TOLERANCE = 1.0
+# Lines made only of figures such as "12.5%", "+40" or "10k" are not headings
+NUM_NOISE_RE = re.compile(r'^[\d.%+k]+$')
 
 def extract_text_from_pdf(pdf_path):
     """
@@ -22,60 +36,82 @@ def extract_text_from_pdf(pdf_path):
     if len(doc) > MAX_PAGES_TO_PROCESS:
         print(f" - INFO: Document has {len(doc)} pages. Processing the first {MAX_PAGES_TO_PROCESS} pages to stay within time limits.")
 
-    # --- Pass 1: Identify potential headings with the most advanced logic ---
-    headings = []
-    all_font_sizes = []
+    # --- Pass 1: Collect font sizes and buffer candidate lines in a single page traversal ---
+    all_font_sizes = array('f')
+    candidate_lines = []
+    # (y0, y1, text, spans) of every line per page, so section content is sliced without
+    # re-parsing pages. spans holds (y0, y1, text) per span for multi-span lines, else None.
+    page_lines = []
     
     for page_num in range(page_count_to_process):
         page = doc[page_num]
         blocks = page.get_text("dict").get("blocks", [])
+        lines_on_page = []
+        page_lines.append(lines_on_page)
         for b in blocks:
             if "lines" in b:
                 for l in b["lines"]:
-                    for s in l["spans"]:
-                        if s["text"].strip():
-                            all_font_sizes.append(s["size"])
+                    spans = l["spans"]
+                    # Most lines hold a single span, which needs no joining.
+                    if len(spans) == 1:
+                        raw_text = spans[0]["text"]
+                        text = raw_text.strip()
+                        if text:
+                            all_font_sizes.append(spans[0]["size"])
+                        span_boxes = None
+                    else:
+                        for s in spans:
+                            if s["text"].strip():
+                                all_font_sizes.append(s["size"])
+                        raw_text = "".join(s["text"] for s in spans)
+                        text = " ".join(s["text"] for s in spans).strip()
+                        span_boxes = tuple((s["bbox"][1], s["bbox"][3], s["text"]) for s in spans)
+                    if text:
+                        span = spans[0]
+                        candidate_lines.append((page_num, span["size"], span["bbox"][1], text))
+                    # Whitespace-only lines are kept as well, since the clipped text included them.
+                    if raw_text:
+                        lines_on_page.append((l["bbox"][1], l["bbox"][3], raw_text, span_boxes))
 
     if not all_font_sizes:
         return []
 
-    median_size = statistics.median(all_font_sizes)
+    median_size = float(np.median(np.frombuffer(all_font_sizes, dtype=np.float32)))
     
     allowed_single_words = {"content", "contents", "notice", "introduction", "summary", "conclusion", "appendix", "glossary", "financials", "operations", "value"}
 
-    for page_num in range(page_count_to_process):
-        page = doc[page_num]
-        blocks = page.get_text("dict").get("blocks", [])
-        for b in blocks:
-            if "lines" in b:
-                for l in b["lines"]:
-                    if l.get("spans"):
-                        span = l["spans"][0]
-                        font_size = span["size"]
-                        text = " ".join(s["text"] for s in l["spans"]).strip()
-
-                        is_large_enough = font_size > median_size * 1.20
-                        is_not_just_number = not text.replace('.', '', 1).replace('%', '').replace('+', '').replace('k', '').isdigit()
-                        is_long_enough = len(text) > 3 and len(text) < 150
-                        is_not_a_sentence = not text.endswith('.') and not text.endswith(',')
-                        is_title_case = text.istitle() or text.isupper()
-                        word_count = len(text.split())
-                        is_concise = word_count < 10
-                        is_valid_single_word = word_count > 1 or (word_count == 1 and text.lower() in allowed_single_words)
-
-                        if is_large_enough and is_not_just_number and is_long_enough and is_not_a_sentence and is_title_case and is_concise and is_valid_single_word:
-                            headings.append({
-                                "text": text,
-                                "page": page_num,
-                                "y": span["bbox"][1]
-                            })
+    # --- Pass 2: Identify potential headings from the buffered lines ---
+    heading_texts = []
+    heading_pages = []
+    heading_ys = []
+    for page_num, font_size, y, text in candidate_lines:
+        is_large_enough = font_size > median_size * 1.20
+        is_not_just_number = not NUM_NOISE_RE.match(text)
+        is_long_enough = len(text) > 3 and len(text) < 150
+        is_not_a_sentence = not text.endswith('.') and not text.endswith(',')
+        is_title_case = text.istitle() or text.isupper()
+        word_count = len(text.split())
+        is_concise = word_count < 10
+        is_valid_single_word = word_count > 1 or (word_count == 1 and text.lower() in allowed_single_words)
+
+        if is_large_enough and is_not_just_number and is_long_enough and is_not_a_sentence and is_title_case and is_concise and is_valid_single_word:
+            heading_texts.append(text)
+            heading_pages.append(page_num)
+            heading_ys.append(y)
 
     unique_headings = []
     seen_texts = set()
-    for h in sorted(headings, key=lambda x: (x["page"], x["y"])):
-        if h["text"].lower() not in seen_texts:
-            unique_headings.append(h)
-            seen_texts.add(h["text"].lower())
+    # Reading order: by page, then by vertical position on the page.
+    for i in np.lexsort((np.array(heading_ys), np.array(heading_pages))).tolist():
+        text = heading_texts[i]
+        key = text.casefold()
+        if key not in seen_texts:
+            unique_headings.append({
+                "text": text,
+                "page": heading_pages[i],
+                "y": heading_ys[i]
+            })
+            seen_texts.add(key)
     
     sorted_headings = unique_headings
 
@@ -107,19 +143,25 @@ def extract_text_from_pdf(pdf_path):
             end_page = next_heading["page"]
             end_y = next_heading["y"]
 
-        content = ""
+        content_lines = []
         loop_end = min(end_page + 1, page_count_to_process)
         for page_num in range(start_page, loop_end):
-            page_rect = doc[page_num].rect
-            clip_rect = page_rect
-            if page_num == start_page and page_num == end_page:
-                clip_rect = fitz.Rect(0, start_y, page_rect.width, end_y)
-            elif page_num == start_page:
-                clip_rect = fitz.Rect(0, start_y, page_rect.width, page_rect.height)
-            elif page_num == end_page:
-                clip_rect = fitz.Rect(0, 0, page_rect.width, end_y)
-            
-            content += doc[page_num].get_text("text", clip=clip_rect)
+            top = start_y if page_num == start_page else float('-inf')
+            bottom = end_y if page_num == end_page else float('inf')
+            if top >= bottom:
+                continue
+            # Same test as the old clip rectangle: keep the text whose bbox overlaps the band.
+            top += CLIP_TOLERANCE
+            bottom -= CLIP_TOLERANCE
+            for y0, y1, text, span_boxes in page_lines[page_num]:
+                if y1 <= top or y0 >= bottom:
+                    continue
+                if span_boxes is not None and (y0 < top or y1 > bottom):
+                    # A line crossing the band edge keeps only its overlapping spans.
+                    text = "".join(t for sy0, sy1, t in span_boxes if sy1 > top and sy0 < bottom)
+                if text:
+                    content_lines.append(text)
+        content = "\n".join(content_lines)
 
         if content.strip():
             sections.append({
@@ -132,6 +174,35 @@ def extract_text_from_pdf(pdf_path):
     doc.close()
     return sections
 
+def pdf_cache_key(pdf_path):
+    """Returns a cache key derived from the PDF's bytes, so renamed copies still hit the cache."""
+    digest = hashlib.sha256(f"v{CACHE_VERSION}:".encode())
+    with open(pdf_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_cached_sections(cache_path, doc_name):
+    """Loads the sections and embeddings saved by save_cached_sections."""
+    with np.load(cache_path) as data:
+        sections = orjson.loads(data['sections'].item())
+        embeddings = data['embeddings']
+    if embeddings.ndim != 2:
+        raise ValueError(f"expected 2-D embeddings, got shape {embeddings.shape}")
+    if len(embeddings) != len(sections):
+        raise ValueError(f"{len(sections)} sections but {len(embeddings)} embeddings")
+    for section in sections:
+        section['doc_name'] = doc_name
+    return sections, embeddings
+
+def save_cached_sections(cache_path, sections, embeddings):
+    """Saves a PDF's sections (as JSON) and their embeddings to a single .npz file."""
+    # Write to a temporary file first so an interrupted run never leaves a truncated entry.
+    tmp_path = cache_path.with_name(cache_path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, sections=np.array(orjson.dumps(sections)), embeddings=embeddings)
+    os.replace(tmp_path, cache_path)
+
 def run_analysis():
     """Main function to run the persona-driven analysis."""
     total_start_time = time.time()
@@ -153,7 +224,6 @@ def run_analysis():
 
     print("Step 3: Processing all PDF documents...")
     t0 = time.time()
-    all_sections = []
     
     # --- FIX: Use a more robust method to find all PDF files ---
     try:
@@ -163,30 +233,73 @@ def run_analysis():
         print(f"   > ERROR: Could not list files in {input_dir}. Reason: {e}")
         pdf_files = []
 
+    # --- OPTIMIZATION: Reuse sections and embeddings of PDFs analysed in an earlier run ---
+    cache_dir = output_dir / '.cache'
+    cache_dir.mkdir(exist_ok=True)
+    cache_paths = {}
+    results = {}
+    for pdf_file in pdf_files:
+        cache_paths[pdf_file] = cache_dir / f"{pdf_cache_key(pdf_file)}.npz"
+        if cache_paths[pdf_file].exists():
+            try:
+                results[pdf_file] = load_cached_sections(cache_paths[pdf_file], pdf_file.name)
+                print(f"- Loaded cached sections for {pdf_file.name}")
+            except Exception as e:
+                print(f"   > WARNING: Ignoring unreadable cache for {pdf_file.name}. Reason: {e}")
+    pdfs_to_extract = [p for p in pdf_files if p not in results]
+
+    extracted = []
     if not pdf_files:
         print("   > WARNING: No PDF files found to process.")
-
-    for pdf_file in pdf_files:
-        print(f"- Extracting sections from {pdf_file.name}")
-        all_sections.extend(extract_text_from_pdf(pdf_file))
-    print(f"   > Extracted {len(all_sections)} total sections in {time.time() - t0:.2f}s")
+    elif pdfs_to_extract:
+        for pdf_file in pdfs_to_extract:
+            print(f"- Extracting sections from {pdf_file.name}")
+        # PDFs are parsed independently, so extract them in parallel; map() keeps the input order.
+        with ProcessPoolExecutor(max_workers=min(len(pdfs_to_extract), os.cpu_count() or 1)) as executor:
+            extracted = list(executor.map(extract_text_from_pdf, pdfs_to_extract))
+    print(f"   > Extracted {sum(len(sections) for sections in extracted)} new sections in {time.time() - t0:.2f}s")
 
     print("Step 4: Ranking sections...")
     t0 = time.time()
     query = f"User is a {persona}. Their goal is to: {job_to_be_done}"
-    query_embedding = model.encode(query, convert_to_tensor=True)
+    query_embedding = model.encode(query, normalize_embeddings=True)
+
+    if pdfs_to_extract:
+        new_sections = [section for sections in extracted for section in sections]
+        section_texts = [section['full_text'][:MAX_CHARS_TO_EMBED] for section in new_sections]
+        if section_texts:
+            new_embeddings = model.encode(section_texts, batch_size=64, show_progress_bar=False, normalize_embeddings=True)
+        else:
+            # encode([]) returns a 1-D array, which could not be concatenated with cached entries later.
+            new_embeddings = np.empty((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
 
+        offset = 0
+        for pdf_file, sections in zip(pdfs_to_extract, extracted):
+            embeddings = new_embeddings[offset:offset + len(sections)]
+            offset += len(sections)
+            try:
+                save_cached_sections(cache_paths[pdf_file], sections, embeddings)
+            except Exception as e:
+                print(f"   > WARNING: Could not cache sections for {pdf_file.name}. Reason: {e}")
+            results[pdf_file] = (sections, embeddings)
+
+    all_sections = [section for pdf_file in pdf_files for section in results[pdf_file][0]]
+
+    ranked_sections = []
     if all_sections:
-        section_texts = [section['full_text'] for section in all_sections]
-        section_embeddings = model.encode(section_texts, convert_to_tensor=True, batch_size=32)
-        
-        cosine_scores = util.cos_sim(query_embedding, section_embeddings)
+        section_embeddings = np.concatenate([results[pdf_file][1] for pdf_file in pdf_files])
+        # Embeddings are L2-normalized, so cosine similarity is a plain dot product.
+        cosine_scores = section_embeddings @ query_embedding
         
         for i, section in enumerate(all_sections):
-            section['relevance_score'] = cosine_scores[0][i].item()
-    print(f"   > Ranking completed in {time.time() - t0:.2f}s")
+            section['relevance_score'] = float(cosine_scores[i])
 
-    ranked_sections = sorted(all_sections, key=lambda x: x.get('relevance_score', -1), reverse=True)
+        # Only the top 10 are reported, so select them in O(n) and sort just those.
+        top_k = min(10, len(all_sections))
+        top_idx = np.argpartition(-cosine_scores, top_k - 1)[:top_k]
+        top_idx = top_idx[np.argsort(-cosine_scores[top_idx], kind='stable')]
+        ranked_sections = [all_sections[i] for i in top_idx.tolist()]
+    print(f"   > Ranking completed in {time.time() - t0:.2f}s")
 
     print("Step 5: Generating final output file...")
     final_output = {
@@ -200,7 +313,7 @@ def run_analysis():
         "sub-section_analysis": []
     }
 
-    for i, section in enumerate(ranked_sections[:10]):
+    for i, section in enumerate(ranked_sections):
         final_output["extracted_section"].append({
             "document": section["doc_name"],
             "page_number": section["page_number"],
@@ -214,8 +327,8 @@ def run_analysis():
         })
 
     output_path = output_dir / 'output.json'
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(final_output, f, indent=2, ensure_ascii=False)
+    with open(output_path, 'wb') as f:
+        f.write(orjson.dumps(final_output, option=orjson.OPT_INDENT_2))
 
     print(f"\nSuccess! Total analysis time: {time.time() - total_start_time:.2f}s")
     print(f"Output saved to {output_path}")